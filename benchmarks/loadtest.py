@@ -0,0 +1,837 @@
+"""Load test and benchmark suite for the SmartAccess server.
+
+Starts main.py in a separate process against an in-memory Mongo stand-in
+(mongomock) and a fake FCM endpoint, drives HTTP and Socket.IO traffic at it
+and saves throughput, latency and event-loop lag figures as JSON so runs can
+be compared between releases. Without face_recognition installed, uploads
+still run but skip the face encoding step, so compare such runs separately.
+
+With --workers > 1 the server runs that many uvicorn workers sharing a
+Socket.IO message queue, and the suite also checks that room emits cross
+workers and that a restarted queue listener neither replays nor drops
+messages. mongomock is per process, so pass --mongo-uri for HTTP figures
+that share data between workers; a mongodb:// queue always needs it.
+
+Usage:
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/loadtest.py run --label v1.2
+    python benchmarks/loadtest.py run --label v1.2-workers --workers 4 \\
+        --message-queue redis://localhost:6379/0
+    python benchmarks/loadtest.py compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import mimetypes
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+LOADTEST_PASSWORD = "loadtest-password"
+LAG_INTERVAL = 0.05
+# Distinct error reasons kept per phase; the rest are counted as "other"
+MAX_ERROR_REASONS = 10
+
+
+def loadtest_email(i):
+    return f"loadtest{i}@example.com"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def raise_fd_limit():
+    # Thousands of Socket.IO clients need more sockets than the usual default
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > 65536:
+        hard = 65536
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ---------------------------------------------------------------------------
+# Server side: runs main.py workers with the Mongo stand-in and a loop monitor
+# ---------------------------------------------------------------------------
+
+
+def seed_database(db, args):
+    import bcrypt
+
+    # Seed users for signin and a large history collection
+    hashed_password = bcrypt.hashpw(LOADTEST_PASSWORD.encode("utf-8"), bcrypt.gensalt())
+    db["users"].insert_many(
+        [
+            {
+                "username": f"loadtest{i}",
+                "email": loadtest_email(i),
+                "password": hashed_password,
+            }
+            for i in range(args.users)
+        ]
+    )
+    db["history"].insert_many(
+        [
+            {
+                "name": f"loadtest{i % args.users}",
+                "image_path": f"history/loadtest{i}.jpg",
+                "date": datetime.now(),
+                "status": i % 2 == 0,
+            }
+            for i in range(args.history_records)
+        ]
+    )
+
+
+def serve(args):
+    import uvicorn
+
+    os.chdir(args.workdir)
+    os.makedirs("faces", exist_ok=True)
+    os.makedirs("history", exist_ok=True)
+
+    if args.mongo_uri:
+        # A real Mongo is shared by all workers, so seed it once
+        import pymongo
+
+        seed_database(pymongo.MongoClient(args.mongo_uri)[os.environ["MONGO_DB"]], args)
+
+    # Worker processes import create_app by name and read their settings here
+    os.environ["LOADTEST_SERVE_ARGS"] = json.dumps(
+        {key: value for key, value in vars(args).items() if key != "func"}
+    )
+    uvicorn.run(
+        "loadtest:create_app",
+        factory=True,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="127.0.0.1",
+        port=args.port,
+        workers=args.workers,
+        log_level="warning",
+    )
+
+
+def create_app():
+    """Build the app for one server worker."""
+    args = argparse.Namespace(**json.loads(os.environ["LOADTEST_SERVE_ARGS"]))
+    raise_fd_limit()
+
+    if not args.mongo_uri:
+        import mongomock
+        import pymongo
+
+        # main.py creates its MongoClient at import time. Every worker gets
+        # its own in-memory database, so each one is seeded separately.
+        pymongo.MongoClient = mongomock.MongoClient
+
+    sys.path.insert(0, REPO_DIR)
+    import main
+
+    main.get_access_token = lambda: "loadtest-access-token"
+    if not args.mongo_uri:
+        seed_database(main.db, args)
+
+    # Lets the suite see which worker a Socket.IO client landed on
+    @main.sio.on("loadtest_whoami")
+    async def loadtest_whoami(sid):
+        return os.getpid()
+
+    lag_samples = []
+
+    async def monitor_loop_lag():
+        # Each sample is (wall start, wall end, lag) so it can be matched to
+        # every phase the sleep overlapped, not just the one it woke up in
+        loop = asyncio.get_running_loop()
+        while True:
+            started_wall = time.time()
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            elapsed = loop.time() - started
+            lag_samples.append(
+                (started_wall, started_wall + elapsed, max(0.0, elapsed - LAG_INTERVAL))
+            )
+
+    async def start_monitor():
+        main.app.state.lag_monitor = asyncio.create_task(monitor_loop_lag())
+
+    async def write_lag_samples():
+        main.app.state.lag_monitor.cancel()
+        lag_file = os.path.join(args.workdir, f"loop_lag_{os.getpid()}.json")
+        with open(lag_file, "w") as file:
+            json.dump(lag_samples, file)
+
+    main.app.add_event_handler("startup", start_monitor)
+    main.app.add_event_handler("shutdown", write_lag_samples)
+    return main.app
+
+
+# ---------------------------------------------------------------------------
+# Fake FCM endpoint
+# ---------------------------------------------------------------------------
+
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    received = 0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        FakeFCMHandler.received += 1
+
+        body = json.dumps({"name": f"projects/loadtest/messages/{self.received}"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_fcm():
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), FakeFCMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Client side: scenarios
+# ---------------------------------------------------------------------------
+
+
+def record_error(errors, reason):
+    if reason not in errors and len(errors) >= MAX_ERROR_REASONS:
+        reason = "other"
+    errors[reason] += 1
+
+
+def http_error(response):
+    return None if response.status_code == 200 else f"HTTP {response.status_code}"
+
+
+async def run_requests(total, concurrency, send):
+    """Call `send(i)` `total` times with at most `concurrency` in flight.
+
+    `send` returns None on success or a short error reason. Returns the
+    latencies of successful calls and a Counter of error reasons.
+    """
+    latencies = []
+    errors = Counter()
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                error = await send(i)
+            except Exception as e:
+                error = type(e).__name__
+            if error is None:
+                latencies.append(time.perf_counter() - started)
+            else:
+                record_error(errors, error)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def load_sample_images():
+    images = []
+    for path in glob.glob(os.path.join(REPO_DIR, "faces", "*", "*")):
+        if path.endswith((".jpg", ".png")):
+            content_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+            with open(path, "rb") as file:
+                images.append((os.path.basename(path), file.read(), content_type))
+    if not images:
+        raise SystemExit("No sample images found under faces/")
+    return images
+
+
+async def scenario_signin(http, args):
+    async def send(i):
+        response = await http.post(
+            "/signin/",
+            json={"email": loadtest_email(i % args.users), "password": LOADTEST_PASSWORD},
+        )
+        return http_error(response)
+
+    return await run_requests(args.signin_requests, args.concurrency, send)
+
+
+async def scenario_upload(http, args):
+    images = load_sample_images()
+
+    async def send(i):
+        filename, content, content_type = images[i % len(images)]
+        response = await http.post(
+            "/upload",
+            files={"image": (filename, content, content_type)},
+            data={
+                "userId": f"loadtest{i % args.users}",
+                "name": f"loadtest{i % args.users}",
+                "accessLevel": "full",
+            },
+        )
+        return http_error(response)
+
+    return await run_requests(args.upload_requests, args.concurrency, send)
+
+
+async def scenario_access_history(http, args):
+    async def send(i):
+        response = await http.get("/access-history")
+        return http_error(response)
+
+    return await run_requests(args.history_requests, args.concurrency, send)
+
+
+async def scenario_gallery(http, args):
+    async def send(i):
+        # Alternate full snapshots with small deltas, as recognizers would
+        since = 0 if i % 2 == 0 else max(0, args.upload_requests - 10)
+        response = await http.get("/gallery", params={"since": since})
+        return http_error(response)
+
+    return await run_requests(args.gallery_requests, args.concurrency, send)
+
+
+async def scenario_notification(http, args):
+    async def send(i):
+        response = await http.post(
+            "/send_notification/",
+            json={
+                "fcm_token": "loadtest-fcm-token",
+                "title": "Load test",
+                "body": f"Notification {i}",
+            },
+        )
+        if response.status_code == 200 and "error" in response.json():
+            return "FCM error"
+        return http_error(response)
+
+    return await run_requests(args.notification_requests, args.concurrency, send)
+
+
+async def scenario_join_room(base_url, args):
+    import socketio
+
+    clients = []
+
+    async def send(i):
+        client = socketio.AsyncClient(reconnection=False)
+        clients.append(client)
+        user_id = f"loadtest-room-{i}"
+        joined = asyncio.get_running_loop().create_future()
+
+        @client.on("notification_count")
+        async def on_count(data):
+            if data.get("user_id") == user_id and not joined.done():
+                joined.set_result(True)
+
+        # The default 1 s connect timeout would count a busy loop as an error
+        await client.connect(
+            base_url, transports=["websocket"], wait_timeout=args.timeout
+        )
+        await client.emit("join_room", {"user_id": user_id})
+        await asyncio.wait_for(joined, timeout=args.timeout)
+
+    try:
+        return await run_requests(args.socket_clients, args.concurrency, send)
+    finally:
+        await asyncio.gather(
+            *(client.disconnect() for client in clients), return_exceptions=True
+        )
+
+
+async def drive(base_url, args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency * 4)
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=args.timeout, limits=limits
+    ) as http:
+        scenarios = {
+            "signin": lambda: scenario_signin(http, args),
+            "upload": lambda: scenario_upload(http, args),
+            "access_history": lambda: scenario_access_history(http, args),
+            "gallery": lambda: scenario_gallery(http, args),
+            "notification": lambda: scenario_notification(http, args),
+            "join_room": lambda: scenario_join_room(base_url, args),
+        }
+
+        phases = []
+        for name, scenario in scenarios.items():
+            print(f"Running {name}...")
+            started = time.time()
+            latencies, errors = await scenario()
+            phases.append((name, started, time.time(), latencies, errors))
+
+        # Everything at once, as a busy deployment would see it
+        print("Running mixed...")
+        started = time.time()
+        results = await asyncio.gather(*(scenario() for scenario in scenarios.values()))
+        ended = time.time()
+
+        latencies = []
+        errors = Counter()
+        for name, (scenario_latencies, scenario_errors) in zip(scenarios, results):
+            phases.append(
+                (f"mixed:{name}", started, ended, scenario_latencies, scenario_errors)
+            )
+            latencies.extend(scenario_latencies)
+            for reason, count in scenario_errors.items():
+                errors[f"{name}: {reason}"] += count
+        phases.insert(len(scenarios), ("mixed", started, ended, latencies, errors))
+
+    return phases
+
+
+async def wait_for_server(base_url, process, timeout):
+    import httpx
+
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as http:
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise SystemExit("Server exited during startup")
+            try:
+                await http.get("/pictures/loadtest-ready")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise SystemExit("Server did not start in time")
+
+
+# ---------------------------------------------------------------------------
+# Multi-worker checks
+# ---------------------------------------------------------------------------
+
+
+async def check_cross_worker_room(base_url, args):
+    """Check that an emit to a room on one worker reaches a client on another."""
+    import socketio
+
+    clients = []
+    by_worker = {}
+    try:
+        # The kernel spreads connections over the workers, so keep connecting
+        # until two clients sit on different ones
+        for _ in range(args.workers * 10):
+            client = socketio.AsyncClient(reconnection=False)
+            clients.append(client)
+            await client.connect(
+                base_url, transports=["websocket"], wait_timeout=args.timeout
+            )
+            pid = await client.call("loadtest_whoami", timeout=args.timeout)
+            by_worker.setdefault(pid, client)
+            if len(by_worker) >= 2:
+                break
+        else:
+            return {"passed": False, "error": "all clients landed on one worker"}
+
+        (sender_pid, sender), (receiver_pid, receiver) = by_worker.items()
+        user_id = f"loadtest-cross-worker-{os.getpid()}"
+        counts = asyncio.Queue()
+
+        @receiver.on("notification_count")
+        async def on_count(data):
+            if data.get("user_id") == user_id:
+                counts.put_nowait(data)
+
+        await receiver.emit("join_room", {"user_id": user_id})
+        await asyncio.wait_for(counts.get(), timeout=args.timeout)
+
+        # The sender's worker emits the count to the room it just joined;
+        # the receiver only gets it through the message queue
+        started = time.perf_counter()
+        await sender.emit("join_room", {"user_id": user_id})
+        try:
+            await asyncio.wait_for(counts.get(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            return {
+                "passed": False,
+                "error": f"emit on worker {sender_pid} never reached worker {receiver_pid}",
+            }
+        return {
+            "passed": True,
+            "sender_worker": sender_pid,
+            "receiver_worker": receiver_pid,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+    finally:
+        await asyncio.gather(
+            *(client.disconnect() for client in clients), return_exceptions=True
+        )
+
+
+async def check_listener_restart(args):
+    """Check that a restarted queue listener neither replays nor drops messages.
+
+    A listener reads a numbered batch, then (on a Mongo queue) has its tailable
+    cursor closed while a second batch is published, so it must resume where
+    it left off. It is then stopped, a batch is published with no listener,
+    and a new listener must receive only the batch published after it started.
+    """
+    sys.path.insert(0, REPO_DIR)
+    from socketio_managers import AsyncMongoManager, create_client_manager
+
+    run_id = os.urandom(8).hex()
+    publisher = create_client_manager(args.message_queue, args.mongo_db)
+    deadline = time.time() + args.timeout
+
+    async def publish(seqs):
+        for seq in seqs:
+            # Workers on the same queue ignore unknown methods
+            await publisher._publish({"method": "loadtest", "run": run_id, "seq": seq})
+
+    def start_listener():
+        manager = create_client_manager(args.message_queue, args.mongo_db)
+        received = []
+
+        async def consume():
+            async for message in manager._listen():
+                data = message if isinstance(message, dict) else json.loads(message)
+                if data.get("run") == run_id:
+                    received.append(data.get("seq"))
+
+        return manager, received, asyncio.create_task(consume())
+
+    async def wait_for(received, seqs):
+        while not set(seqs) <= set(received) and time.time() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def wait_until_listening(received):
+        # Subscribing happens in the background, so publish probes until one
+        # gets through
+        while None not in received and time.time() < deadline:
+            await publish([None])
+            await asyncio.sleep(0.1)
+
+    first, first_received, first_task = start_listener()
+    await wait_until_listening(first_received)
+    expected_first = list(range(0, 20))
+    await publish(range(0, 20))
+    await wait_for(first_received, expected_first)
+
+    reopened = isinstance(first, AsyncMongoManager)
+    if reopened:
+        # Simulates the cursor dying, e.g. on a Mongo failover
+        first.cursor.close()
+        expected_first += list(range(20, 40))
+        await publish(range(20, 40))
+        await wait_for(first_received, expected_first)
+
+    first_task.cancel()
+    await publish(range(40, 60))
+
+    second, second_received, second_task = start_listener()
+    await wait_until_listening(second_received)
+    expected_second = list(range(60, 80))
+    await publish(range(60, 80))
+    await wait_for(second_received, expected_second)
+    # Leave time for late duplicates to show up
+    await asyncio.sleep(0.5)
+    second_task.cancel()
+
+    results = {}
+    for name, received, expected in (
+        ("first", first_received, expected_first),
+        ("second", second_received, expected_second),
+    ):
+        seqs = [seq for seq in received if seq is not None]
+        results[name] = {
+            "dropped": sorted(set(expected) - set(seqs)),
+            "replayed": sorted(set(seqs) - set(expected)),
+            "duplicated": sorted({seq for seq in seqs if seqs.count(seq) > 1}),
+            "in_order": seqs == sorted(seqs),
+        }
+
+    return {
+        "passed": all(
+            not (result["dropped"] or result["replayed"] or result["duplicated"])
+            and result["in_order"]
+            for result in results.values()
+        ),
+        "cursor_reopened": reopened,
+        "listeners": results,
+    }
+
+
+def loop_lag_stats(lag_samples, started, ended):
+    lags = []
+    blocked = 0.0
+    for sample_start, sample_end, lag in lag_samples:
+        if sample_start >= ended or sample_end <= started:
+            continue
+        lags.append(lag)
+        # The loop was blocked for the last `lag` seconds of the sleep
+        blocked += max(0.0, min(sample_end, ended) - max(sample_end - lag, started))
+    return lags, blocked
+
+
+def summarize(phases, lag_samples):
+    summary = {}
+    for name, started, ended, latencies, errors in phases:
+        duration = ended - started
+        lags, blocked = loop_lag_stats(lag_samples, started, ended)
+        error_count = sum(errors.values())
+        summary[name] = {
+            "requests": len(latencies) + error_count,
+            "errors": error_count,
+            "error_reasons": dict(errors.most_common()),
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(max(latencies, default=0.0) * 1000, 2),
+            "loop_lag_p50_ms": round(percentile(lags, 50) * 1000, 2),
+            "loop_lag_p99_ms": round(percentile(lags, 99) * 1000, 2),
+            "loop_lag_max_ms": round(max(lags, default=0.0) * 1000, 2),
+            "loop_blocked_ms": round(blocked * 1000, 2),
+        }
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+async def run_checks(base_url, args):
+    checks = {}
+    for name, check in (
+        ("cross_worker_room", lambda: check_cross_worker_room(base_url, args)),
+        ("listener_restart", lambda: check_listener_restart(args)),
+    ):
+        print(f"Checking {name}...")
+        try:
+            checks[name] = await check()
+        except Exception as e:
+            checks[name] = {"passed": False, "error": f"{type(e).__name__}: {e}"}
+    return checks
+
+
+def run(args):
+    if args.workers > 1 and not args.message_queue:
+        raise SystemExit("--workers > 1 needs --message-queue")
+    if (args.message_queue or "").startswith("mongodb") and not args.mongo_uri:
+        # mongomock has no tailable cursors
+        raise SystemExit("A mongodb:// message queue needs --mongo-uri")
+
+    raise_fd_limit()
+    workdir = tempfile.mkdtemp(prefix="smartaccess-loadtest-")
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    fcm_server = start_fake_fcm()
+    # A scratch database, so a run never touches real data
+    args.mongo_db = f"loadtest_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+    env = dict(os.environ)
+    # Overrides .env, whose Atlas SRV URI mongomock would try to resolve
+    env["MONGO_URI"] = args.mongo_uri or "mongodb://localhost"
+    env["MONGO_DB"] = args.mongo_db
+    env["FCM_URL"] = f"http://127.0.0.1:{fcm_server.server_port}/messages:send"
+    env["SOCKETIO_WORKERS"] = str(args.workers)
+    env["SOCKETIO_MESSAGE_QUEUE"] = args.message_queue or ""
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "serve",
+        "--workdir", workdir,
+        "--port", str(port),
+        "--workers", str(args.workers),
+        "--users", str(args.users),
+        "--history-records", str(args.history_records),
+    ]
+    if args.mongo_uri:
+        command += ["--mongo-uri", args.mongo_uri]
+    process = subprocess.Popen(command, env=env)
+
+    checks = {}
+    try:
+        asyncio.run(wait_for_server(base_url, process, args.startup_timeout))
+        phases = asyncio.run(drive(base_url, args))
+        if args.workers > 1:
+            checks = asyncio.run(run_checks(base_url, args))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fcm_server.shutdown()
+        if args.mongo_uri:
+            import pymongo
+
+            pymongo.MongoClient(args.mongo_uri).drop_database(args.mongo_db)
+
+    # One file per worker; lag figures cover all of them
+    lag_samples = []
+    for lag_file in glob.glob(os.path.join(workdir, "loop_lag_*.json")):
+        with open(lag_file) as file:
+            lag_samples.extend(json.load(file))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "label": args.label,
+        "git_revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "fcm_messages_received": FakeFCMHandler.received,
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            # URLs can carry credentials
+            if key not in ("command", "func", "output", "mongo_uri", "message_queue")
+        },
+        "message_queue": urlparse(args.message_queue).scheme if args.message_queue else None,
+        "scenarios": summarize(phases, lag_samples),
+        "checks": checks,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{args.label}_{stamp}.json")
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    print_summary(result)
+    print(f"Results saved to {output}")
+
+
+def print_summary(result):
+    print(f"\n{result['label']} ({result['git_revision']})")
+    print(
+        f"{'scenario':<22}{'req':>8}{'err':>6}{'rps':>10}"
+        f"{'p50 ms':>10}{'p99 ms':>10}{'lag p99':>10}{'lag max':>10}{'blocked':>10}"
+    )
+    for name, stats in result["scenarios"].items():
+        print(
+            f"{name:<22}{stats['requests']:>8}{stats['errors']:>6}"
+            f"{stats['throughput_rps']:>10}{stats['p50_ms']:>10}"
+            f"{stats['p99_ms']:>10}{stats['loop_lag_p99_ms']:>10}"
+            f"{stats['loop_lag_max_ms']:>10}{stats['loop_blocked_ms']:>10}"
+        )
+    for name, stats in result["scenarios"].items():
+        for reason, count in stats["error_reasons"].items():
+            print(f"  {name}: {count} x {reason}")
+    for name, check in result.get("checks", {}).items():
+        print(f"{name}: {'passed' if check['passed'] else 'FAILED'}")
+        if not check["passed"]:
+            print(f"  {json.dumps(check)}")
+
+
+def compare(args):
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+
+    print(f"{baseline['label']} -> {candidate['label']}")
+    print(f"{'scenario':<22}{'metric':<18}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, stats in candidate["scenarios"].items():
+        base_stats = baseline["scenarios"].get(name)
+        if not base_stats:
+            continue
+        for metric in (
+            "throughput_rps",
+            "p50_ms",
+            "p99_ms",
+            "errors",
+            "loop_lag_p99_ms",
+            "loop_lag_max_ms",
+            "loop_blocked_ms",
+        ):
+            # Results saved before a metric was added don't have it
+            if metric not in base_stats:
+                continue
+            old, new = base_stats[metric], stats[metric]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{name:<22}{metric:<18}{old:>12}{new:>12}{change:>10}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the load suite")
+    run_parser.add_argument("--label", default="local")
+    run_parser.add_argument("--output", help="result file (default: benchmarks/results/)")
+    run_parser.add_argument("--concurrency", type=int, default=50)
+    run_parser.add_argument("--users", type=int, default=20)
+    run_parser.add_argument("--history-records", type=int, default=50000)
+    run_parser.add_argument("--signin-requests", type=int, default=200)
+    run_parser.add_argument("--upload-requests", type=int, default=500)
+    run_parser.add_argument("--history-requests", type=int, default=50)
+    run_parser.add_argument("--gallery-requests", type=int, default=200)
+    run_parser.add_argument("--notification-requests", type=int, default=200)
+    run_parser.add_argument("--socket-clients", type=int, default=2000)
+    run_parser.add_argument("--timeout", type=float, default=60.0)
+    run_parser.add_argument("--startup-timeout", type=float, default=60.0)
+    run_parser.add_argument("--workers", type=int, default=1, help="server worker processes")
+    run_parser.add_argument(
+        "--message-queue",
+        help="Socket.IO queue URL (redis:// or mongodb://), needed for --workers > 1",
+    )
+    run_parser.add_argument(
+        "--mongo-uri", help="use a real Mongo (in a scratch database) instead of mongomock"
+    )
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=compare)
+
+    # Internal: the server process started by `run`
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--workdir", required=True)
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--workers", type=int, default=1)
+    serve_parser.add_argument("--mongo-uri")
+    serve_parser.add_argument("--users", type=int, default=20)
+    serve_parser.add_argument("--history-records", type=int, default=50000)
+    serve_parser.set_defaults(func=serve)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
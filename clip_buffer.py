@@ -0,0 +1,235 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+# H.264 plays in browsers and mobile web views; MPEG-4 Part 2 is the fallback
+# for OpenCV builds without an H.264 encoder
+CLIP_CODECS = ("avc1", "mp4v")
+
+
+class FrameRingBuffer:
+    """Keeps the most recent JPEG-compressed frames of one camera.
+
+    The buffer is bounded both by frame count and by total bytes, so memory
+    use stays fixed no matter how large individual frames get.
+    """
+
+    def __init__(self, max_frames, max_bytes):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.frames = deque()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def push(self, timestamp, jpeg_bytes):
+        with self.lock:
+            self.frames.append((timestamp, jpeg_bytes))
+            self.total_bytes += len(jpeg_bytes)
+
+            # Drop the oldest frames until both limits are respected
+            while self.frames and (
+                len(self.frames) > self.max_frames or self.total_bytes > self.max_bytes
+            ):
+                _, old_bytes = self.frames.popleft()
+                self.total_bytes -= len(old_bytes)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.frames)
+
+
+class ClipRecorder:
+    """Records short pre/post-event clips for a single camera.
+
+    Frames are pushed from the capture loop with `add_frame`. When `trigger`
+    is called the frames already in the ring buffer become the start of the
+    clip, the next `post_seconds` of frames are appended, and the finished
+    clip is handed to a background thread that encodes it to disk. The
+    capture loop never waits on the encoder: if the encoder falls behind,
+    new clips are dropped instead. The optional `on_saved` callback passed to
+    `trigger` runs on the encoder thread once the clip file exists.
+    """
+
+    def __init__(
+        self,
+        clip_dir,
+        pre_seconds=3,
+        post_seconds=3,
+        fps=10,
+        max_buffer_bytes=16 * 1024 * 1024,
+        max_pending_clips=4,
+        jpeg_quality=80,
+    ):
+        self.clip_dir = clip_dir
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.fps = fps
+        self.jpeg_quality = jpeg_quality
+        self.max_pending_clips = max_pending_clips
+        self.buffer = FrameRingBuffer(pre_seconds * fps, max_buffer_bytes)
+
+        # Clips still collecting post-event frames:
+        # [clip_path, deadline, frames, on_saved]
+        self.active_clips = []
+        self.last_frame_time = 0.0
+
+        self.encode_queue = queue.Queue(maxsize=max_pending_clips)
+        self.encoder_thread = threading.Thread(target=self._encode_loop, daemon=True)
+        os.makedirs(clip_dir, exist_ok=True)
+
+    def start(self):
+        self.encoder_thread.start()
+
+    def stop(self):
+        # Flush whatever is still recording so the linked clips exist
+        for clip_path, _, frames, on_saved in self.active_clips:
+            self._submit(clip_path, frames, on_saved)
+        self.active_clips = []
+        self.encode_queue.put(None)
+        self.encoder_thread.join()
+
+    def add_frame(self, frame):
+        now = time.time()
+
+        # Sample the stream at the configured clip frame rate
+        if now - self.last_frame_time < 1.0 / self.fps:
+            return
+        self.last_frame_time = now
+
+        ok, encoded = cv2.imencode(
+            ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        )
+        if not ok:
+            return
+        jpeg_bytes = encoded.tobytes()
+        self.buffer.push(now, jpeg_bytes)
+
+        still_recording = []
+        for clip_path, deadline, frames, on_saved in self.active_clips:
+            frames.append((now, jpeg_bytes))
+            if now >= deadline:
+                self._submit(clip_path, frames, on_saved)
+            else:
+                still_recording.append([clip_path, deadline, frames, on_saved])
+        self.active_clips = still_recording
+
+    def trigger(self, name, on_saved=None):
+        """Start recording a clip for an access event.
+
+        Returns the path the clip will be written to, or None when too many
+        clips are already waiting to be encoded. `on_saved(clip_path)` is only
+        called if the clip is actually written.
+        """
+        if len(self.active_clips) + self.encode_queue.qsize() >= self.max_pending_clips:
+            print(f"Clip recorder busy, skipping clip for {name}")
+            return None
+
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        clip_path = os.path.join(self.clip_dir, f"{name}_{timestamp}.mp4")
+        now = time.time()
+
+        # The buffer can reach further back than pre_seconds when frames
+        # arrive slower than fps, so cut it by timestamp
+        pre_frames = [
+            (frame_time, jpeg_bytes)
+            for frame_time, jpeg_bytes in self.buffer.snapshot()
+            if frame_time >= now - self.pre_seconds
+        ]
+        self.active_clips.append(
+            [clip_path, now + self.post_seconds, pre_frames, on_saved]
+        )
+        return clip_path
+
+    def _submit(self, clip_path, frames, on_saved):
+        try:
+            self.encode_queue.put_nowait((clip_path, frames, on_saved))
+        except queue.Full:
+            print(f"Clip encoder queue full, dropping {clip_path}")
+
+    def _encode_loop(self):
+        while True:
+            job = self.encode_queue.get()
+            if job is None:
+                break
+            clip_path, frames, on_saved = job
+            try:
+                saved = self._write_clip(clip_path, frames)
+            except Exception as e:
+                print(f"Error writing clip {clip_path}: {e}")
+                continue
+
+            if saved and on_saved is not None:
+                try:
+                    on_saved(clip_path)
+                except Exception as e:
+                    print(f"Error handling saved clip {clip_path}: {e}")
+
+    def _open_writer(self, path, width, height):
+        for codec in CLIP_CODECS:
+            writer = cv2.VideoWriter(
+                path, cv2.VideoWriter_fourcc(*codec), self.fps, (width, height)
+            )
+            if writer.isOpened():
+                return writer
+            writer.release()
+        raise RuntimeError(f"No video codec available, tried {', '.join(CLIP_CODECS)}")
+
+    def _write_clip(self, clip_path, frames):
+        """Encode `frames` to `clip_path`. Returns True if the file was written."""
+        if not frames:
+            return False
+
+        # Write to a temporary file first so a half-written clip is never served
+        root, ext = os.path.splitext(clip_path)
+        tmp_path = f"{root}.part{ext}"
+        writer = None
+
+        # Frames arrive at whatever rate the capture loop manages, so pick the
+        # latest frame for each output tick to keep playback in real time
+        start_time = frames[0][0]
+        frame_count = int((frames[-1][0] - start_time) * self.fps) + 1
+        index = 0
+        decoded_index = None
+        image = None
+
+        try:
+            for tick in range(frame_count):
+                tick_time = start_time + tick / self.fps
+                while index + 1 < len(frames) and frames[index + 1][0] <= tick_time:
+                    index += 1
+
+                if index != decoded_index:
+                    decoded_index = index
+                    image = cv2.imdecode(
+                        np.frombuffer(frames[index][1], dtype=np.uint8),
+                        cv2.IMREAD_COLOR,
+                    )
+                if image is None:
+                    continue
+                if writer is None:
+                    height, width = image.shape[:2]
+                    writer = self._open_writer(tmp_path, width, height)
+                elif image.shape[:2] != (height, width):
+                    image = cv2.resize(image, (width, height))
+                writer.write(image)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            if writer is not None:
+                writer.release()
+
+        if writer is None:
+            print(f"No decodable frames for clip {clip_path}")
+            return False
+
+        os.replace(tmp_path, clip_path)
+        print(f"Clip saved to {clip_path}")
+        return True
@@ -0,0 +1,147 @@
+import struct
+import threading
+
+import numpy as np
+import requests
+from bson import ObjectId
+
+# Binary gallery format (little endian):
+#   header: magic, format version, flags, gallery version, upsert count, delete count
+#   upsert: 12-byte picture id, name length, utf-8 name, 128 float32 encoding
+#   delete: 12-byte picture id
+GALLERY_MAGIC = b"SAGL"
+GALLERY_FORMAT = 1
+FLAG_FULL = 1
+ENCODING_SIZE = 128
+
+HEADER = struct.Struct("<4sBBQII")
+NAME_LENGTH = struct.Struct("<H")
+ENCODING_BYTES = ENCODING_SIZE * 4
+
+
+def encode_face(image_path):
+    """Return the float32 encoding of the first face in the image, or None."""
+    try:
+        # Imported here so the API server still starts without dlib installed
+        import face_recognition
+
+        image = face_recognition.load_image_file(image_path)
+        face_encs = face_recognition.face_encodings(image)
+    except Exception as e:
+        print(f"Error encoding {image_path}: {e}")
+        return None
+
+    if not face_encs:
+        print(f"No faces found in {image_path}")
+        return None
+    return np.asarray(face_encs[0], dtype=np.float32).tobytes()
+
+
+def pack_gallery(version, full, upserts, deletes):
+    """Pack gallery entries into the binary format.
+
+    `upserts` is a list of (picture_id, name, encoding_bytes) and `deletes`
+    a list of picture ids.
+    """
+    parts = [
+        HEADER.pack(
+            GALLERY_MAGIC,
+            GALLERY_FORMAT,
+            FLAG_FULL if full else 0,
+            version,
+            len(upserts),
+            len(deletes),
+        )
+    ]
+    for picture_id, name, encoding in upserts:
+        name_bytes = name.encode("utf-8")
+        parts.append(ObjectId(picture_id).binary)
+        parts.append(NAME_LENGTH.pack(len(name_bytes)))
+        parts.append(name_bytes)
+        parts.append(encoding)
+    for picture_id in deletes:
+        parts.append(ObjectId(picture_id).binary)
+    return b"".join(parts)
+
+
+def unpack_gallery(data):
+    """Unpack the binary format into (version, full, upserts, deletes)."""
+    magic, fmt, flags, version, upsert_count, delete_count = HEADER.unpack_from(data)
+    if magic != GALLERY_MAGIC or fmt != GALLERY_FORMAT:
+        raise ValueError("Unsupported gallery format")
+
+    offset = HEADER.size
+    upserts = []
+    for _ in range(upsert_count):
+        picture_id = data[offset : offset + 12].hex()
+        offset += 12
+        (name_length,) = NAME_LENGTH.unpack_from(data, offset)
+        offset += NAME_LENGTH.size
+        name = data[offset : offset + name_length].decode("utf-8")
+        offset += name_length
+        encoding = np.frombuffer(data, dtype=np.float32, count=ENCODING_SIZE, offset=offset)
+        offset += ENCODING_BYTES
+        upserts.append((picture_id, name, encoding))
+
+    deletes = []
+    for _ in range(delete_count):
+        deletes.append(data[offset : offset + 12].hex())
+        offset += 12
+
+    return version, bool(flags & FLAG_FULL), upserts, deletes
+
+
+class GalleryCache:
+    """Keeps a recognizer's face gallery in sync with the server.
+
+    A background thread polls `/gallery` with the last version it has seen
+    and applies the returned delta. `snapshot` is replaced as a whole so the
+    capture loop can read it without locking.
+    """
+
+    def __init__(self, api_url, interval=1.0):
+        self.api_url = api_url
+        self.interval = interval
+        self.version = 0
+        self.entries = {}
+        self.snapshot = ([], [])
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sync_loop, daemon=True)
+
+    def sync(self):
+        response = requests.get(
+            f"{self.api_url}/gallery", params={"since": self.version}, timeout=5
+        )
+        response.raise_for_status()
+        version, full, upserts, deletes = unpack_gallery(response.content)
+
+        changed = bool(upserts or deletes or (full and self.entries))
+        if full:
+            self.entries = {}
+        for picture_id, name, encoding in upserts:
+            self.entries[picture_id] = (name, encoding)
+        for picture_id in deletes:
+            self.entries.pop(picture_id, None)
+
+        if changed:
+            entries = list(self.entries.values())
+            self.snapshot = (
+                [encoding for _, encoding in entries],
+                [name for name, _ in entries],
+            )
+            print(f"Gallery synced to version {version} ({len(entries)} encodings)")
+        self.version = version
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _sync_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print("Error syncing gallery:", e)
@@ -1,4 +1,6 @@
 import os
+import asyncio
+import time
 import uvicorn
 from typing import List
 import aiofiles
@@ -10,23 +12,51 @@ from pydantic import BaseModel, EmailStr
 from fastapi.staticfiles import StaticFiles
 from bson import ObjectId
 import requests
-from pymongo import MongoClient
-from fastapi.responses import JSONResponse
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from fastapi.responses import JSONResponse, Response
 import bcrypt
 from dotenv import load_dotenv
 from datetime import datetime
+from contextlib import contextmanager
 import google.auth
 from google.auth.transport.requests import Request
 from google.oauth2 import service_account
 import json
 import jwt
 import shutil
+from socketio_managers import create_client_manager
+from gallery import encode_face, pack_gallery
+
+load_dotenv()
+
+# Multi-worker mode is opt-in: SOCKETIO_WORKERS > 1 runs that many uvicorn
+# worker processes. Socket.IO clients must then connect with
+# transports: ['websocket'], since long-polling needs sticky sessions.
+WORKERS = int(os.getenv("SOCKETIO_WORKERS", 1))
+# Message queue shared by all workers (redis://, amqp:// or mongodb:// URL)
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+# Database for app data and for a mongodb:// message queue
+MONGO_DB = os.getenv("MONGO_DB", "CameraDb")
+
+if WORKERS > 1 and not SOCKETIO_MESSAGE_QUEUE:
+    raise RuntimeError("SOCKETIO_WORKERS > 1 requires SOCKETIO_MESSAGE_QUEUE to be set")
 
 # Create the FastAPI app
 app = FastAPI()
 
 # Socket.IO setup
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+sio_options = {}
+if WORKERS > 1:
+    # Without sticky sessions, long-polling requests can land on any worker
+    sio_options["transports"] = ["websocket"]
+
+sio = socketio.AsyncServer(
+    async_mode="asgi",
+    cors_allowed_origins="*",
+    client_manager=create_client_manager(SOCKETIO_MESSAGE_QUEUE, MONGO_DB),
+    **sio_options,
+)
 socket_app = socketio.ASGIApp(sio, app)
 
 # Mount static files
@@ -35,6 +65,9 @@ if not os.path.exists(upload_dir):
     os.makedirs(upload_dir)
 app.mount("/faces", StaticFiles(directory="faces"), name="faces")
 app.mount("/history", StaticFiles(directory="history"), name="history")
+clips_dir = "clips/"
+os.makedirs(clips_dir, exist_ok=True)
+app.mount("/clips", StaticFiles(directory="clips"), name="clips")
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -45,17 +78,172 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 client = MongoClient(MONGO_URI)
 
-db = client["CameraDb"]
+db = client[MONGO_DB]
 users_collection = db["users"]
 pictures_collection = db["pictures"]
 history_collection = db["history"]
+# Gallery version counter and deleted pictures, for recognizer delta-sync
+gallery_collection = db["gallery"]
+gallery_deletions_collection = db["gallery_deletions"]
+# Shared by all workers, keyed by user id
+notification_counts_collection = db["notification_counts"]
+
+
+def increment_notification_count(user_id):
+    counter = notification_counts_collection.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": {"count": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["count"]
+
+
+def get_notification_count(user_id):
+    counter = notification_counts_collection.find_one({"_id": user_id})
+    return counter["count"] if counter else 0
+
+
+# Versions still pending after this many seconds belong to a writer that died
+GALLERY_PENDING_TIMEOUT = 30
+# Lease on the backfill claim document, renewed after every picture
+GALLERY_BACKFILL_LEASE = 60
+# How often workers check for pictures still waiting to be backfilled
+GALLERY_BACKFILL_RETRY = 30
+
+
+def allocate_gallery_version():
+    while True:
+        counter = gallery_collection.find_one({"_id": "version"})
+        if counter is None:
+            try:
+                gallery_collection.insert_one({"_id": "version", "value": 0})
+            except DuplicateKeyError:
+                pass
+            continue
+
+        # Compare-and-set so the new version is marked pending in the same write
+        version = counter["value"] + 1
+        result = gallery_collection.update_one(
+            {"_id": "version", "value": counter["value"]},
+            {"$set": {"value": version, f"pending.{version}": time.time()}},
+        )
+        if result.modified_count:
+            return version
+
+
+@contextmanager
+def gallery_change():
+    """Allocate a gallery version for a write; it stays pending until the
+    write is done so /gallery never reports a version it cannot serve."""
+    version = allocate_gallery_version()
+    try:
+        yield version
+    finally:
+        gallery_collection.update_one(
+            {"_id": "version"}, {"$unset": {f"pending.{version}": ""}}
+        )
+
+
+def get_gallery_version():
+    counter = gallery_collection.find_one({"_id": "version"})
+    if not counter:
+        return 0
+
+    # Every version below the oldest in-flight one is fully written
+    cutoff = time.time() - GALLERY_PENDING_TIMEOUT
+    pending = counter.get("pending", {})
+    in_flight = [int(version) for version, started in pending.items() if started >= cutoff]
+    abandoned = [version for version, started in pending.items() if started < cutoff]
+    if abandoned:
+        gallery_collection.update_one(
+            {"_id": "version"},
+            {"$unset": {f"pending.{version}": "" for version in abandoned}},
+        )
+
+    return min(in_flight) - 1 if in_flight else counter["value"]
+
+
+def claim_gallery_backfill(owner):
+    now = time.time()
+    try:
+        gallery_collection.update_one(
+            {"_id": "backfill", "expires": {"$lt": now}},
+            {"$set": {"owner": owner, "expires": now + GALLERY_BACKFILL_LEASE}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # Another worker holds the claim
+        return False
+
+
+def backfill_gallery():
+    # Pictures uploaded before gallery versioning have no version yet. Only
+    # one worker runs this, the others would re-encode the same pictures.
+    owner = str(ObjectId())
+    if not claim_gallery_backfill(owner):
+        return
+
+    try:
+        for picture in pictures_collection.find({"version": None}):
+            image_path = picture.get("picture")
+            encoding = encode_face(image_path) if image_path else None
+
+            claimed = pictures_collection.update_one(
+                {"_id": picture["_id"], "version": None},
+                {"$set": {"encoding": encoding}},
+            )
+            if claimed.matched_count == 0:
+                continue
+
+            with gallery_change() as version:
+                pictures_collection.update_one(
+                    {"_id": picture["_id"]}, {"$set": {"version": version}}
+                )
+
+            gallery_collection.update_one(
+                {"_id": "backfill", "owner": owner},
+                {"$set": {"expires": time.time() + GALLERY_BACKFILL_LEASE}},
+            )
+    finally:
+        gallery_collection.update_one(
+            {"_id": "backfill", "owner": owner}, {"$set": {"expires": 0}}
+        )
+
+
+def record_gallery_deletion(picture_id):
+    with gallery_change() as version:
+        gallery_deletions_collection.insert_one(
+            {"picture_id": ObjectId(picture_id), "version": version}
+        )
+
+
+async def run_gallery_backfill():
+    # Keep retrying while versionless pictures remain: another worker may hold
+    # the claim, or a worker that died mid-backfill left a lease to expire
+    while pictures_collection.find_one({"version": None}, {"_id": 1}):
+        try:
+            await asyncio.to_thread(backfill_gallery)
+        except Exception as e:
+            print(f"Gallery backfill failed: {e!r}")
+        await asyncio.sleep(GALLERY_BACKFILL_RETRY)
+
+
+def log_backfill_result(task):
+    if not task.cancelled() and task.exception():
+        print(f"Gallery backfill stopped: {task.exception()!r}")
 
-# Store notification counts (in production, use a database)
-notification_counts = {}
+
+@app.on_event("startup")
+async def prepare_gallery():
+    pictures_collection.create_index("version")
+    gallery_deletions_collection.create_index("version")
+    app.state.gallery_backfill = asyncio.create_task(run_gallery_backfill())
+    app.state.gallery_backfill.add_done_callback(log_backfill_result)
 
 
 # Pydantic models
@@ -98,6 +286,9 @@ class AccessHistoryItem(BaseModel):
 # Firebase Cloud Messaging credentials
 PROJECT_ID = "smartaccess-3df78"
 SERVICE_ACCOUNT_FILE = "smartaccess-3df78-firebase-adminsdk-fbsvc-7f6ca951c9.json"
+FCM_URL = os.getenv(
+    "FCM_URL", f"https://fcm.googleapis.com/v1/projects/{PROJECT_ID}/messages:send"
+)
 
 
 def get_access_token():
@@ -119,7 +310,7 @@ async def send_notification(notification: NotificationData):
     access_token = get_access_token()
 
     # FCM HTTP v1 API URL
-    url = f"https://fcm.googleapis.com/v1/projects/{PROJECT_ID}/messages:send"
+    url = FCM_URL
 
     # Set up headers for the request
     headers = {
@@ -143,10 +334,10 @@ async def send_notification(notification: NotificationData):
 
     # Update notification count and emit Socket.IO event
     user_id = "blabla"
-    notification_counts[user_id] = notification_counts.get(user_id, 0) + 1
+    count = increment_notification_count(user_id)
     await sio.emit(
         "notification_count",
-        {"user_id": user_id, "count": notification_counts[user_id]},
+        {"user_id": user_id, "count": count},
     )
 
     # Check if the request was successful
@@ -166,8 +357,7 @@ async def connect(sid, environ):
 async def reset_notification_counts(sid):
     # Reset all notification counts
     print("reset")
-    global notification_counts
-    notification_counts = {}
+    notification_counts_collection.delete_many({})
 
     # Emit a confirmation to all clients that the counts have been reset
     await sio.emit(
@@ -184,12 +374,12 @@ async def disconnect(sid):
 @sio.event
 async def join_room(sid, data):
     user_id = data["user_id"]
-    sio.enter_room(sid, user_id)
+    await sio.enter_room(sid, user_id)
     print(f"User {user_id} joined room")
     # Send current count when user joins
     await sio.emit(
         "notification_count",
-        {"user_id": user_id, "count": notification_counts.get(user_id, 0)},
+        {"user_id": user_id, "count": get_notification_count(user_id)},
         room=user_id,
     )
     print("user connected ", data)
@@ -279,14 +469,20 @@ async def upload_image(
                 content={"error": "No image or imageUrl provided"}, status_code=400
             )
 
-        picture_data = {
-            "userId": userId,
-            "name": name,
-            "picture": file_path,
-            "accessLevel": accessLevel,
-        }
+        # Encode off the event loop; stored so recognizers never re-encode
+        encoding = await asyncio.to_thread(encode_face, file_path)
 
-        pictures_collection.insert_one(picture_data)
+        with gallery_change() as gallery_version:
+            picture_data = {
+                "userId": userId,
+                "name": name,
+                "picture": file_path,
+                "accessLevel": accessLevel,
+                "encoding": encoding,
+                "version": gallery_version,
+            }
+
+            pictures_collection.insert_one(picture_data)
 
         return JSONResponse(
             content={
@@ -295,6 +491,7 @@ async def upload_image(
                 "userId": userId,
                 "name": name,
                 "accessLevel": accessLevel,
+                "galleryVersion": gallery_version,
             }
         )
 
@@ -305,7 +502,9 @@ async def upload_image(
 @app.get("/pictures/{user_id}")
 async def get_user_pictures(user_id: str):
     try:
-        pictures = list(pictures_collection.find({"userId": user_id}))
+        pictures = list(
+            pictures_collection.find({"userId": user_id}, {"encoding": 0})
+        )
 
         for picture in pictures:
             picture["_id"] = str(picture["_id"])
@@ -347,6 +546,8 @@ async def delete_picture(picture_id: str):
                     status_code=500,
                 )
 
+            record_gallery_deletion(picture_id)
+
             return JSONResponse(
                 content={
                     "message": "Picture record deleted successfully from database (file not found)"
@@ -369,6 +570,8 @@ async def delete_picture(picture_id: str):
                 status_code=500,
             )
 
+        record_gallery_deletion(picture_id)
+
         return JSONResponse(
             content={
                 "message": "Picture and directory deleted successfully, both from database and server"
@@ -379,6 +582,44 @@ async def delete_picture(picture_id: str):
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+@app.get("/gallery")
+async def get_gallery(since: int = 0):
+    try:
+        version = get_gallery_version()
+
+        # Unknown or missing versions get the whole gallery
+        full = since <= 0 or since > version
+        version_range = {"$lte": version}
+        if not full:
+            version_range["$gt"] = since
+
+        pictures = pictures_collection.find(
+            {"version": version_range, "encoding": {"$ne": None}},
+            {"name": 1, "encoding": 1},
+        )
+        upserts = [
+            (picture["_id"], picture["name"], picture["encoding"])
+            for picture in pictures
+        ]
+
+        deletes = []
+        if not full:
+            deletes = [
+                deletion["picture_id"]
+                for deletion in gallery_deletions_collection.find(
+                    {"version": version_range}
+                )
+            ]
+
+        return Response(
+            content=pack_gallery(version, full, upserts, deletes),
+            media_type="application/octet-stream",
+            headers={"X-Gallery-Version": str(version)},
+        )
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
 @app.get("/history/{user_id}")
 async def get_user_history(user_id: str):
     try:
@@ -440,6 +681,7 @@ async def get_access_history():
                 ),
                 "status": record.get("status", False),
                 "image_path": record.get("image_path", ""),
+                "clip_path": record.get("clip_path", ""),
             }
             for record in records
         ]
@@ -480,13 +722,16 @@ async def clear_history():
         # Delete all documents from the MongoDB collection
         result = history_collection.delete_many({})
 
-        # Delete all files in the 'history' directory
-        history_dir = "history"
-        if os.path.exists(history_dir):
-            for file in os.listdir(history_dir):
-                file_path = os.path.join(history_dir, file)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
+        # Delete all files in the 'history' and 'clips' directories
+        for history_dir in ("history", "clips"):
+            if os.path.exists(history_dir):
+                for file in os.listdir(history_dir):
+                    # Clips still being encoded; they are dropped once written
+                    if ".part." in file:
+                        continue
+                    file_path = os.path.join(history_dir, file)
+                    if os.path.isfile(file_path):
+                        os.remove(file_path)
 
         return {
             "status": "success",
@@ -502,4 +747,8 @@ app.mount("/", socket_app)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if WORKERS > 1:
+        # Workers import the app themselves, so it must be passed by name
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
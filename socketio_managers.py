@@ -0,0 +1,143 @@
+import asyncio
+import json
+import threading
+import time
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+from pymongo import CursorType, MongoClient
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+
+class AsyncMongoManager(AsyncPubSubManager):
+    """Socket.IO client manager that uses a capped MongoDB collection as a
+    message queue.
+
+    Every worker publishes by inserting into the collection and listens with
+    a tailable cursor, so emits reach clients connected to any worker without
+    running a separate broker.
+    """
+
+    name = "mongo"
+
+    def __init__(
+        self,
+        url,
+        channel="socketio",
+        write_only=False,
+        logger=None,
+        database="CameraDb",
+        collection_size=16 * 1024 * 1024,
+    ):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.client = MongoClient(url)
+        db = self.client[database]
+
+        try:
+            db.create_collection(channel, capped=True, size=collection_size)
+        except CollectionInvalid:
+            # Already created by another worker
+            pass
+
+        self.collection = db[channel]
+        self.messages = None
+        # Tailable cursor currently read by the listener thread
+        self.cursor = None
+
+        # A tailable cursor dies when its query matches nothing, so keep a
+        # marker document in an otherwise empty collection
+        if self.collection.find_one() is None:
+            self.collection.insert_one({"message": None})
+
+    async def _publish(self, data):
+        await asyncio.to_thread(
+            self.collection.insert_one,
+            {"message": json.dumps(data)},
+        )
+
+    async def _listen(self):
+        if self.messages is None:
+            self.messages = asyncio.Queue()
+            threading.Thread(
+                target=self._tail,
+                args=(asyncio.get_running_loop(),),
+                daemon=True,
+            ).start()
+
+        while True:
+            yield await self.messages.get()
+
+    def _tail(self, loop):
+        # Position of the last document read, in insertion ($natural) order
+        last_id = None
+        started = False
+
+        while True:
+            try:
+                if not started:
+                    # Start after the newest document so old messages are not replayed
+                    newest = self.collection.find_one(sort=[("$natural", -1)])
+                    last_id = newest["_id"] if newest else None
+                    started = True
+                elif last_id is not None and not self.collection.find_one(
+                    {"_id": last_id}
+                ):
+                    self._get_logger().warning(
+                        "Socket.IO Mongo listener fell behind the capped collection"
+                    )
+                    last_id = None
+
+                # Resume by skipping up to the last position seen. _id order
+                # is not insertion order across workers, so a $gt query on it
+                # would lose messages.
+                skipping = last_id is not None
+                self.cursor = self.collection.find(
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while self.cursor.alive:
+                    for document in self.cursor:
+                        if skipping:
+                            skipping = document["_id"] != last_id
+                            continue
+                        last_id = document["_id"]
+                        if document["message"] is not None:
+                            loop.call_soon_threadsafe(
+                                self.messages.put_nowait,
+                                json.loads(document["message"]),
+                            )
+
+                    # last_id can be overwritten after the check above but
+                    # before the cursor reached it. Everything left in the
+                    # collection is then newer, so read it all from the start.
+                    if skipping and not self.collection.find_one({"_id": last_id}):
+                        self._get_logger().warning(
+                            "Socket.IO Mongo listener fell behind the capped collection"
+                        )
+                        last_id = None
+                        self.cursor.close()
+                        break
+            except PyMongoError as e:
+                self._get_logger().error(f"Socket.IO Mongo listener error: {e}")
+                time.sleep(1)
+
+            # Reached when the cursor was killed (e.g. by a server restart) or reopened
+            time.sleep(0.1)
+
+
+def create_client_manager(url, database="CameraDb"):
+    """Return a Socket.IO client manager for the given message queue URL.
+
+    Supports Redis (``redis://``), RabbitMQ (``amqp://``) and MongoDB
+    (``mongodb://``, using a capped collection in `database`). Returns None
+    when no URL is set, which keeps the default in-memory manager for
+    single-process serving.
+    """
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return socketio.AsyncRedisManager(url)
+    if url.startswith(("amqp://", "amqps://")):
+        return socketio.AsyncAioPikaManager(url)
+    if url.startswith(("mongodb://", "mongodb+srv://")):
+        return AsyncMongoManager(url, database=database)
+    raise ValueError(f"Unsupported Socket.IO message queue URL: {url}")
@@ -8,9 +8,10 @@ from pymongo import MongoClient
 from PIL import Image
 import time
 import hashlib
+from functools import partial
 from dotenv import load_dotenv
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from clip_buffer import ClipRecorder
+from gallery import GalleryCache
 
 load_dotenv()
 
@@ -21,27 +22,11 @@ collection = db["history"]
 
 # Define history directory
 history_dir = "history/"
+clips_dir = "clips/"
 os.makedirs(history_dir, exist_ok=True)
 os.makedirs("faces", exist_ok=True)
 
 
-class FaceDirectoryHandler(FileSystemEventHandler):
-    def __init__(self, callback):
-        self.callback = callback
-
-    def on_created(self, event):
-        if not event.is_directory and event.src_path.endswith(('.jpg', '.png')):
-            self.callback()
-
-    def on_deleted(self, event):
-        if not event.is_directory and event.src_path.endswith(('.jpg', '.png')):
-            self.callback()
-
-    def on_modified(self, event):
-        if not event.is_directory and event.src_path.endswith(('.jpg', '.png')):
-            self.callback()
-
-
 def save_image_to_history(image, name, status):
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     filename = f"{name}_{timestamp}.jpg"
@@ -55,58 +40,48 @@ def save_image_to_history(image, name, status):
         "date": datetime.now(),
         "status": status,
     }
-    collection.insert_one(picture_data)
+    result = collection.insert_one(picture_data)
     print(f"Image saved to {file_path} and added to MongoDB")
+    return result.inserted_id
 
 
-def load_face_encodings(database_path):
-    encodings = []
-    names = []
-    print("Loading face database...")
-
-    for person_name in os.listdir(database_path):
-        person_folder = os.path.join(database_path, person_name)
-        if os.path.isdir(person_folder):
-            for file in os.listdir(person_folder):
-                if file.endswith(".jpg") or file.endswith(".png"):
-                    image_path = os.path.join(person_folder, file)
-                    print(f"Loading image: {image_path}")
-                    image = face_recognition.load_image_file(image_path)
-                    face_encs = face_recognition.face_encodings(image)
+def link_clip_to_history(history_id, clip_path):
+    # Runs once the clip file exists; drop it if the entry was deleted meanwhile
+    result = collection.update_one(
+        {"_id": history_id}, {"$set": {"clip_path": clip_path}}
+    )
+    if result.matched_count == 0:
+        os.remove(clip_path)
 
-                    if face_encs:
-                        encodings.append(face_encs[0])
-                        names.append(person_name)
-                    else:
-                        print(f"No faces found in {image_path}")
 
-    print(f"Loaded {len(encodings)} encodings from the database.")
-    return encodings, names
+def wait_and_record(cap, recorder, seconds):
+    # Keep feeding the clip buffer while recognition is paused
+    end_time = time.time() + seconds
+    while time.time() < end_time:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        recorder.add_frame(frame)
 
 
 def main():
-    database_path = "faces/"
     FCM_TOKEN = os.getenv("FCM_TOKEN")
     API_URL = os.getenv("API_URL")
 
-    # Global variables to store face encodings
-    global encodings, names
-    encodings, names = load_face_encodings(database_path)
-
-    if len(encodings) == 0:
-        print("No encodings were loaded. Please check the 'faces/' folder.")
-        exit()
+    # Face gallery synced from the server instead of encoding faces/ locally
+    gallery = GalleryCache(API_URL, float(os.getenv("GALLERY_SYNC_INTERVAL", 1)))
+    try:
+        gallery.sync()
+    except Exception as e:
+        print("Error syncing gallery:", e)
 
-    # Set up file system observer
-    def reload_encodings():
-        global encodings, names
-        print("Detected changes in faces directory. Reloading encodings...")
-        encodings, names = load_face_encodings(database_path)
+    if len(gallery.snapshot[0]) == 0:
+        print("No encodings in the gallery yet. Waiting for pictures to be uploaded.")
+    gallery.start()
 
-    event_handler = FaceDirectoryHandler(reload_encodings)
-    observer = Observer()
-    observer.schedule(event_handler, database_path, recursive=True)
-    observer.start()
+    # Pre/post-event clip recording for the camera
+    recorder = ClipRecorder(clips_dir)
+    recorder.start()
 
     try:
         cap = cv2.VideoCapture(0)
@@ -117,6 +92,8 @@ def main():
                 print("Failed to grab frame")
                 break
 
+            recorder.add_frame(frame)
+            encodings, names = gallery.snapshot
             rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             face_locations = face_recognition.face_locations(rgb_frame)
             face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
@@ -136,7 +113,8 @@ def main():
                     pil_image = Image.fromarray(face_image)
                     print(f"Recognized {name}!")
 
-                    save_image_to_history(pil_image, name, True)
+                    history_id = save_image_to_history(pil_image, name, True)
+                    recorder.trigger(name, partial(link_clip_to_history, history_id))
                     try:
                         response = requests.post(
                             f"{API_URL}/send_notification/",
@@ -147,13 +125,14 @@ def main():
                             },
                         )
                         print("Notification response:", response.text)
-                        time.sleep(5)
+                        wait_and_record(cap, recorder, 5)
                     except Exception as e:
                         print("Error sending notification:", e)
                 else:
                     face_image = frame[top:bottom, left:right]
                     pil_image = Image.fromarray(face_image)
-                    save_image_to_history(pil_image, name, False)
+                    history_id = save_image_to_history(pil_image, name, False)
+                    recorder.trigger(name, partial(link_clip_to_history, history_id))
                     try:
                         response = requests.post(
                             f"{API_URL}/send_notification/",
@@ -164,7 +143,7 @@ def main():
                             },
                         )
                         print("Notification response:", response.text)
-                        time.sleep(5)
+                        wait_and_record(cap, recorder, 5)
                     except Exception as e:
                         print("Error sending notification:", e)
 
@@ -179,8 +158,8 @@ def main():
                 break
 
     finally:
-        observer.stop()
-        observer.join()
+        gallery.stop()
+        recorder.stop()
         cap.release()
         cv2.destroyAllWindows()
 